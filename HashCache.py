@@ -1,36 +1,89 @@
 # ---------- SQLite-backed hash cache ----------
+import itertools
 import logging
+import os
+import queue
 import sqlite3
+import sys
 import threading
+import time
+from collections import Counter
+from enum import IntEnum
 from pathlib import Path
-from typing import Optional, Any
+from typing import Optional, Any, Dict, List, Union
+
+from utils import default_hasher
 
 # ---------- logging ----------
 logger = logging.getLogger(__name__)
 
 # ---------- HashCache ----------
+class Table(IntEnum):
+    """ Cache sides, what the public API's 'out_cache'/'in_cache' names resolve to. """
+    OUT = 0
+    IN = 1
+
 def _stat_file(_file_path: Path):
-    # try to resolve the path
+    # paths are canonicalized once at ingest (scanner / Track.from_file), don't pay for realpath() again
+    try:
+        return _file_path, os.stat(_file_path)
+    except OSError as e:
+        logger.error("Unable to stat file: %s", e)
+        return _file_path, None
+
+# ---------- hash encoding ----------
+# hashes are stored as raw digests, half the bytes of their hex form in both the table and the signature index
+def _digest_to_blob(digest: Optional[str]):
+    """ hex digest -> raw bytes, anything that doesn't parse is stored as is """
+    try:
+        return bytes.fromhex(digest)
+    except (TypeError, ValueError):
+        return digest
+
+def _blob_to_digest(value) -> Optional[str]:
+    return value.hex() if isinstance(value, bytes) else value
+
+def _sig_to_blob(sig: Optional[str]):
+    """ '0x'-prefixed hex(int) signature -> raw bytes, anything that doesn't parse is stored as is """
     try:
-        _file_path = Path(_file_path).resolve()
-    except FileNotFoundError as e:
-        logger.error(f"Unable to resolve path, file not found: {e}")
-        return None
-    except RuntimeError as e:
-        logger.error(f"Unable to resolve path, infinite loop: {e}")
-        return None
-    return _file_path, _file_path.stat()
+        value = int(sig, 16)
+        return value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big")
+    except (TypeError, ValueError):
+        return sig
+
+def _blob_to_sig(value) -> Optional[str]:
+    return hex(int.from_bytes(value, "big")) if isinstance(value, bytes) else value
 
 
 class HashCache:
     """
     SQLite-backed cache stored at <output_dir>/<cache_filename>
 
-    Tables:
+    Tables (the public API addresses them by name or by Table):
       out_cache (destination file metadata cache)
       in_cache (input file metadata cache)
+    Both are stored as rows of a single WITHOUT ROWID 'cache' table, keyed on (side, path).
     """
-    VALID_TABLES = ["out_cache", "in_cache"]
+    VALID_TABLES = frozenset({"out_cache", "in_cache"})
+    # table name -> Table, public methods take either
+    TABLES = {"out_cache": Table.OUT, "in_cache": Table.IN}
+    # table name -> value of the side column
+    TABLE_SIDES = {"out_cache": "out", "in_cache": "in"}
+    # Table -> value of the side column, indexed by the enum's int value
+    SIDES = ("out", "in")
+    CACHE_TABLE = "cache"
+    # stored in PRAGMA user_version, bump whenever the DDL in _create_schema or the stored hash format changes
+    SCHEMA_VERSION = 4
+    # metadata hashes written below this version were computed field by field, see _rehash_metadata
+    JOINED_HASH_VERSION = 3
+    # page size for newly created DB files, fewer and wider b-tree levels for the whole index
+    PAGE_SIZE = 32768
+    # queued writes per transaction, and how long the writer waits for a batch to fill up
+    BATCH_SIZE = 256
+    WRITER_LINGER = 0.1
+    WRITER_QUEUE_SIZE = 4096
+    # paths per SELECT ... IN (...) in get_many, under SQLite's default 999 variable limit
+    GET_MANY_CHUNK = 900
 
     def __init__(self,
             output_dir: Path = ".",
@@ -39,54 +92,214 @@ class HashCache:
         ):
         self.output_dir = Path(output_dir)
         self.db_path = self.output_dir / cache_filename
+        # guards the connection list and the writer thread's startup, never held across SQLite I/O
         self._lock = threading.Lock()
-        self._conn: Optional[sqlite3.Connection] = None
+        # serializes our own write transactions (writer thread, remove_many)
+        self._write_lock = threading.Lock()
+        # one connection per thread, so WAL readers can run concurrently
+        self._tls = threading.local()
+        self._conns: List[sqlite3.Connection] = []
         self._disabled = bool(disabled)
+        # op -> SQL, shared by both sides of the cache table, built once so sqlite3's statement cache reuses the compiled plans
+        self._stmts: dict[str, str] = {}
+        self._prepare_statements()
+        # writes are queued as (op, table, params) and committed in batches by a single writer thread
+        self._q: queue.Queue = queue.Queue(maxsize=self.WRITER_QUEUE_SIZE)
+        self._writer: Optional[threading.Thread] = None
+        # paths are keyed in their os.fsencode() form everywhere: SQLite and the write queue
+        # (table, path) -> number of queued writes not yet committed
+        self._inflight: Counter = Counter()
+        self._inflight_lock = threading.Lock()
+        # set between begin_bulk_load() and end_bulk_load(), new connections pick it up in _connect
+        self._bulk_loading = False
 
+        # a disabled cache never touches the filesystem
+        if self._disabled:
+            return
         self._ensure_db_dir()
 
     def _ensure_db_dir(self):
         try:
             self.db_path.parent.mkdir(parents=True, exist_ok=True)
         except Exception as e:
-            logger.error(f"Something horrible has happened, {self.db_path.parent} containing DB cannot be created: {e}")
+            logger.error("Something horrible has happened, %s containing DB cannot be created: %s", self.db_path.parent, e)
             pass
 
     def _connect(self):
-        # return existing connection
-        if self._conn:
-            return self._conn
+        if self._disabled:
+            return None
+        # return existing connection for this thread
+        conn = getattr(self._tls, "conn", None)
+        if conn:
+            return conn
         # attempt to connect to DB and create requisite tables
         try:
-            conn = sqlite3.connect(self.db_path, timeout=15)
-            conn.execute("PRAGMA journal_mode=WAL;")
-            conn.execute("PRAGMA synchronous=NORMAL;")
-            for _ in self.VALID_TABLES:
-                # create table
-                conn.execute(str(f"""
-                CREATE TABLE IF NOT EXISTS {_} (
-                    path TEXT PRIMARY KEY,
-                    mtime REAL NOT NULL,
-                    size INTEGER NOT NULL,
-                        artist TEXT,
-                        album TEXT,
-                        title TEXT,
-                        track_number INTEGER,
-                        metadata_hash TEXT,
-                    audio_md5_signature TEXT
-                );""" ))
-                # create index for table
-                conn.execute(str(f"CREATE INDEX IF NOT EXISTS {_}_hash_idx ON {_}(audio_md5_signature);"))
-                # let's hope that explicitly casting it as a str does the replacement before it attempts to run
-            conn.commit()
+            # each thread only uses its own connection, check_same_thread is off so close() can reap them all
+            # isolation_level=None: no implicit transactions, writes issue their own BEGIN/COMMIT
+            conn = sqlite3.connect(self.db_path, timeout=15, cached_statements=256,
+                                   check_same_thread=False, isolation_level=None)
+            # only takes effect on a new, still empty DB file, so it has to come before WAL and the schema
+            conn.execute(f"PRAGMA page_size={self.PAGE_SIZE};")
+            # WAL is persistent in the file, only switch when it isn't already set
+            if conn.execute("PRAGMA journal_mode;").fetchone()[0].lower() != "wal":
+                conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=OFF;" if self._bulk_loading else "PRAGMA synchronous=NORMAL;")
+            # keep checkpoints out of the sync loop, close() runs one at the end
+            conn.execute("PRAGMA wal_autocheckpoint=10000;")
+            # ~64MB page cache and in-memory temp tables, the whole index should fit in RAM
+            conn.execute("PRAGMA cache_size=-65536;")
+            conn.execute("PRAGMA temp_store=MEMORY;")
+            # 256MB mmap, only where the address space can afford it
+            if sys.maxsize > 2**32:
+                conn.execute("PRAGMA mmap_size=268435456;")
+            # a DB already at the current schema version skips the DDL entirely
+            if conn.execute("PRAGMA user_version;").fetchone()[0] < self.SCHEMA_VERSION:
+                self._create_schema(conn)
         except Exception as e:
-            logger.error(f"Something horrible has happened during DB connection: {e}")
+            logger.error("Something horrible has happened during DB connection: %s", e)
             conn = None
 
         # return
-        self._conn = conn
+        if conn:
+            self._tls.conn = conn
+            # reused for every statement on this thread, instead of conn.execute() building a new Cursor per call
+            self._tls.cur = conn.cursor()
+            with self._lock:
+                self._conns.append(conn)
         return conn
 
+    def _create_schema(self, conn: sqlite3.Connection):
+        """ Create the cache table and index, migrate older layouts, then stamp SCHEMA_VERSION. """
+        # create table
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.CACHE_TABLE} (
+            side TEXT NOT NULL,
+            path BLOB NOT NULL,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+                artist TEXT,
+                album TEXT,
+                title TEXT,
+                track_number INTEGER,
+                metadata_hash BLOB,
+            audio_md5_signature BLOB,
+            dev INTEGER,
+            ino INTEGER,
+            PRIMARY KEY (side, path)
+        ) WITHOUT ROWID;""")
+        # the index needs the columns added by the migration
+        self._migrate_schema(conn)
+        # create index for table
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {self.CACHE_TABLE}_inode_idx "
+                     f"ON {self.CACHE_TABLE}(side, dev, ino);")
+        conn.execute(f"PRAGMA user_version={self.SCHEMA_VERSION};")
+
+    def _cursor(self) -> Optional[sqlite3.Cursor]:
+        """ Return this thread's persistent cursor, connecting first if needed. """
+        if not self._connect():
+            return None
+        return self._tls.cur
+
+    def _migrate_schema(self, conn: sqlite3.Connection):
+        """
+            Bring rows written by older versions up to the current layout.
+              - the old per-table layout (one rowid 'out_cache'/'in_cache' table each) is moved into the cache table,
+                in primary key order, so the WITHOUT ROWID b-tree is filled sequentially.
+              - TEXT paths are converted to the BLOB (os.fsencode) form used as the key now.
+              - the dev/ino columns are added to tables created before they existed.
+              - the (side, audio_md5_signature) index, which no query used, is dropped.
+              - metadata hashes from before JOINED_HASH_VERSION are recomputed from the cached tags.
+            Runs inside a single write transaction, so only the first connection to get there does any work.
+        """
+        migrated = False
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            # 0 is a new DB, nothing to rehash
+            version = conn.execute("PRAGMA user_version;").fetchone()[0]
+            for table in self.VALID_TABLES:
+                legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;",
+                                      (table,)).fetchone()
+                if not legacy:
+                    continue
+                logger.info("Migrating legacy cache table '%s' into '%s'", table, self.CACHE_TABLE)
+                conn.execute(f"""
+                    INSERT OR REPLACE INTO {self.CACHE_TABLE}
+                        (side, path, mtime, size, metadata_hash,
+                         artist, album, title, track_number, audio_md5_signature)
+                    SELECT ?, CAST(path AS BLOB), mtime, size, metadata_hash,
+                           artist, album, title, track_number, audio_md5_signature
+                    FROM {table} ORDER BY path;
+                """, (self.TABLE_SIDES[table],))
+                # also drops its index
+                conn.execute(f"DROP TABLE {table};")
+                migrated = True
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({self.CACHE_TABLE});")}
+            for column in ("dev", "ino"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {self.CACHE_TABLE} ADD COLUMN {column} INTEGER;")
+            conn.execute(f"DROP INDEX IF EXISTS {self.CACHE_TABLE}_sig_idx;")
+            # CAST of a TEXT value yields its UTF-8 bytes, which is what os.fsencode produces for it
+            conn.execute(f"UPDATE OR REPLACE {self.CACHE_TABLE} SET path = CAST(path AS BLOB) "
+                         f"WHERE typeof(path) = 'text';")
+            if migrated or 0 < version < self.JOINED_HASH_VERSION:
+                self._rehash_metadata(conn)
+            conn.execute("COMMIT;")
+        except Exception:
+            conn.execute("ROLLBACK;")
+            raise
+
+        # the old rowid tables leave free pages behind, rebuild once so the WITHOUT ROWID b-tree is packed
+        if migrated:
+            conn.execute("VACUUM;")
+
+    def _rehash_metadata(self, conn: sqlite3.Connection):
+        """
+            Recompute every row's metadata_hash in place, as Track._create_track would for the cached tags,
+            so rows cached before the hash format changed still compare equal to freshly read files.
+        """
+        logger.info("Recomputing cached metadata hashes")
+        conn.create_function("track_metadata_hash", 3,
+                             lambda title, artist, album: _digest_to_blob(default_hasher.hash_str_list([title, artist, album])),
+                             deterministic=True)
+        conn.execute(f"UPDATE {self.CACHE_TABLE} SET metadata_hash = track_metadata_hash(title, artist, album);")
+
+    def _prepare_statements(self):
+        """
+            Pre-format the hot SQL, one statement per op shared by every table.
+                Each distinct string is compiled once by sqlite3 and then served from its statement cache.
+        """
+        # the IN list is filled per chunk size, so it is formatted at call time
+        self._stmts["get_many"] = f"""
+            SELECT path, artist, album, title, track_number, audio_md5_signature,
+                   mtime, size, metadata_hash
+            FROM {self.CACHE_TABLE} WHERE side = ? AND path IN ({{params}});
+        """
+        self._stmts["get_by_inode"] = f"""
+            SELECT artist, album, title, track_number, audio_md5_signature,
+                   mtime, size, metadata_hash
+            FROM {self.CACHE_TABLE} INDEXED BY {self.CACHE_TABLE}_inode_idx
+            WHERE side = ? AND dev = ? AND ino = ? AND mtime = ? AND size = ?
+            LIMIT 1;
+        """
+        self._stmts["upsert"] = f"""
+            INSERT INTO {self.CACHE_TABLE}
+                (side, path, mtime, size, metadata_hash,
+                 artist, album, title, track_number, audio_md5_signature, dev, ino)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(side, path) DO UPDATE SET
+                mtime = excluded.mtime,
+                size = excluded.size,
+                metadata_hash = excluded.metadata_hash,
+                artist = excluded.artist,
+                album = excluded.album,
+                title = excluded.title,
+                track_number = excluded.track_number,
+                audio_md5_signature = excluded.audio_md5_signature,
+                dev = excluded.dev,
+                ino = excluded.ino;
+        """
+        self._stmts["delete"] = f"DELETE FROM {self.CACHE_TABLE} WHERE side = ? AND path = ?;"
+
     def is_disabled(self):
         if self._disabled:
             # must be true, we are disabled
@@ -99,19 +312,27 @@ class HashCache:
 
     def enable(self):
         self._disabled = False
+        # may have been skipped if we were constructed disabled
+        self._ensure_db_dir()
         return self._disabled
 
-    def is_table_invalid(self, provided_table: str):
-        if provided_table not in self.VALID_TABLES:
-            logger.error(f"Provided table: '{provided_table}' is not a valid_table.")
-            return True
-        return False
+    def is_table_invalid(self, provided_table: Union[Table, str]):
+        return self._table(provided_table) is None
+
+    def _table(self, provided_table: Union[Table, str]) -> Optional[Table]:
+        """ Resolve a Table or table name to its Table, None (and logged) if it isn't one. """
+        if isinstance(provided_table, Table):
+            return provided_table
+        table = self.TABLES.get(provided_table)
+        if table is None:
+            logger.error("Provided table: '%s' is not a valid_table.", provided_table)
+        return table
 
     # ---------- cache API ----------
-    def get_track_metadata_if_unchanged_mtime_size(self, src: Path, table: str) -> Optional[dict]:
+    def get_track_metadata_if_unchanged_mtime_size(self, src: Path, table: Union[Table, str]) -> Optional[dict]:
         """
             Return cached Track metadata if exists and if cache entry matches mtime+size; else None.
-                Will automatically resolve the provided path to an absolute path.
+                The provided path is expected to already be absolute.
         """
         if self.is_disabled() or self.is_table_invalid(table):
             # HashCache is disabled, or we provided an invalid table...
@@ -119,113 +340,298 @@ class HashCache:
 
         # preps file path and statistics
         src, st = _stat_file(src)
-        logger.debug(f"Attempting metadata retrieval from cache for {src} from table {table}")
+        if not st:
+            return None
+        return self.get_many(table, {src: st}).get(src)
+
+    def get_many(self, table: Union[Table, str], file_stats: Dict[Path, os.stat_result],
+                 present: Optional[set] = None) -> Dict[Path, dict]:
+        """
+            Bulk version of get_track_metadata_if_unchanged_mtime_size, for the scanner, trusting its paths and stats.
+                Looks up GET_MANY_CHUNK paths per query and returns {path: metadata} for the entries whose mtime+size
+                still match, paths that miss or are stale are left out.
+                If present is provided, every path that has a row, stale or not, is added to it.
+        """
+        if self.is_disabled():
+            return {}
+        table = self._table(table)
+        if table is None or not file_stats:
+            return {}
+
+        # queued writes have to be in SQLite before it's asked
+        if self._inflight:
+            self.flush()
 
+        keys = {os.fsencode(src): src for src in file_stats}
+        key_list = list(keys)
+        found = {}
         try:
-            conn = self._connect()
-            with self._lock:
-                sql = f"""
-                    SELECT artist, album, title, track_number, audio_md5_signature,
-                           mtime, size, metadata_hash
-                    FROM {table} WHERE path = ?;
-                """
-                cur = conn.execute(sql, (str(src),))
-                row = cur.fetchone()
-            # check for results
-            if not row:
-                return None
-            # unpack results
-            artist, album, title, track_number, audio_md5_signature, cached_mtime, cached_size, metahash = row
-
-            # if the modified time and size match the current file information
-            if float(cached_mtime) == float(st.st_mtime) and int(cached_size) == int(st.st_size):
-                return {
-                    "abs_path": src,
-                    "artist": artist,
-                    "album": album,
-                    "title": title,
-                    "track_number": track_number,
-                    "metadata_hash": metahash,
-                    "md5_audsig": audio_md5_signature,
-                }
+            cur = self._cursor()
+            for i in range(0, len(key_list), self.GET_MANY_CHUNK):
+                chunk = key_list[i:i + self.GET_MANY_CHUNK]
+                rows = cur.execute(self._stmts["get_many"].format(params=", ".join("?" * len(chunk))),
+                                   (self.SIDES[table], *chunk)).fetchall()
+                for (key, artist, album, title, track_number, audio_md5_signature,
+                     cached_mtime, cached_size, metahash) in rows:
+                    src = keys[key]
+                    if present is not None:
+                        present.add(src)
+                    st = file_stats[src]
+                    # if the modified time and size match the current file information
+                    if float(cached_mtime) != float(st.st_mtime) or int(cached_size) != int(st.st_size):
+                        continue
+                    found[src] = {
+                        "abs_path": src,
+                        "artist": artist,
+                        "album": album,
+                        "title": title,
+                        "track_number": track_number,
+                        "metadata_hash": _blob_to_digest(metahash),
+                        "md5_audsig": _blob_to_sig(audio_md5_signature),
+                    }
+        except Exception as e:
+            logger.error("GET: Error looking up %d paths in table '%s': %s", len(key_list), table.name, e)
+        return found
+
+    def get_track_metadata_by_inode(self, src: Path, table: Union[Table, str],
+                                    st: os.stat_result) -> Optional[dict]:
+        """
+            Return cached Track metadata of a file with the same (dev, inode, mtime, size) as st, under any path; else None.
+                Catches files that were renamed or moved since they were cached, the result carries src as its path.
+        """
+        if self.is_disabled():
+            return None
+        table = self._table(table)
+        if table is None:
+            return None
+        # without a real inode number (e.g. DirEntry.stat() on Windows) every file would look alike
+        if not st.st_ino:
             return None
+
+        # best effort, a row still waiting in the write queue just means a miss
+        try:
+            cur = self._cursor()
+            rows = cur.execute(self._stmts["get_by_inode"], (self.SIDES[table], st.st_dev, st.st_ino,
+                                                             float(st.st_mtime), int(st.st_size))).fetchall()
+            if not rows:
+                return None
+            artist, album, title, track_number, audio_md5_signature, cached_mtime, cached_size, metahash = rows[0]
+            return {
+                "abs_path": src,
+                "artist": artist,
+                "album": album,
+                "title": title,
+                "track_number": track_number,
+                "metadata_hash": _blob_to_digest(metahash),
+                "md5_audsig": _blob_to_sig(audio_md5_signature),
+            }
         except Exception as e:
-            logger.error(f"{src}: {e}")
+            logger.error("%s: %s", src, e)
             return None
 
-    def set_from_track_obj(self, src: Path, table: str, track: Any):
-        """Set cache entry for src."""
-        if self.is_disabled() or self.is_table_invalid(table):
+    def set_from_track_obj(self, src: Path, table: Union[Table, str], track: Any):
+        """
+            Set cache entry for src.
+                The row is queued for the writer thread, which commits up to BATCH_SIZE writes per transaction.
+        """
+        if self.is_disabled():
+            return False
+        table = self._table(table)
+        if table is None:
             return False
 
         src, st = _stat_file(src)
         # if it returns nothing, we know to fail
         if not st:
-            logger.error("Failed to read filesystem information for track: {track}")
+            logger.error("Failed to read filesystem information for track: %s", track)
             return False
-        logger.debug(src)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s", src)
 
         try:
-            conn = self._connect()
-            with self._lock:
-                sql = f"""
-                    INSERT INTO {table}
-                        (path, mtime, size, metadata_hash,
-                         artist, album, title, track_number, audio_md5_signature)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(path) DO UPDATE SET
-                        mtime = excluded.mtime,
-                        size = excluded.size,
-                        metadata_hash = excluded.metadata_hash,
-                        artist = excluded.artist,
-                        album = excluded.album,
-                        title = excluded.title,
-                        track_number = excluded.track_number,
-                        audio_md5_signature = excluded.audio_md5_signature;
-                """
-                conn.execute(
-                    sql,
-                    (
-                        str(src),
-                        float(st.st_mtime),
-                        int(st.st_size),
-                        track.metadata_hash,
-                        track.artist,
-                        track.album,
-                        track.title,
-                        int(track.track_number),
-                        track.md5_audsig,
-                    ),
-                )
-                conn.commit()
-                logger.debug(f"SET: Successfully set track info table '{table}' for {src}")
-                return True
+            row = (
+                os.fsencode(src),
+                float(st.st_mtime),
+                int(st.st_size),
+                _digest_to_blob(track.metadata_hash),
+                track.artist,
+                track.album,
+                track.title,
+                int(track.track_number),
+                _sig_to_blob(track.md5_audsig),
+                st.st_dev,
+                st.st_ino,
+            )
         except Exception as e:
-            logger.debug(f"ERROR: SET: Error setting track information in table '{table}' for {src}: {e}")
-        return False
+            logger.debug("ERROR: SET: Error setting track information in table '%s' for %s: %s", table.name, src, e)
+            return False
 
-    def remove(self, src: Path, table: str):
-        """Remove cache entry for if present."""
-        if self.is_disabled() or self.is_table_invalid(table):
+        self._enqueue("upsert", table, row)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("SET: Queued track info for table '%s' for %s", table.name, src)
+        return True
+
+    def remove_many(self, table: Union[Table, str], paths: List[Path]):
+        """
+            Remove the cache entries of many paths inside a single transaction, on the calling thread.
+                Queued writes are flushed first, so none of them can land after the delete.
+        """
+        if self.is_disabled():
+            return False
+        table = self._table(table)
+        if table is None:
             return False
+        if not paths:
+            return True
 
+        keys = [os.fsencode(p) for p in paths]
+        self.flush()
         try:
-            conn = self._connect()
-            with self._lock:
-                sql = f"DELETE FROM {table} WHERE path = ?;"
-                conn.execute(str(sql), (str(src),))
-                conn.commit()
+            self._write_batch([("delete", table, (key,)) for key in keys])
+            logger.debug("REMOVE: Successfully removed %d rows from table '%s'", len(keys), table.name)
             return True
         except Exception as e:
-            logger.debug(f"REMOVE: Error removing track information in table '{table}' for {src}: {e}")
+            logger.error("REMOVE: Error removing %d rows from table '%s': %s", len(keys), table.name, e)
         return False
 
+    def remove(self, src: Path, table: Union[Table, str]):
+        """
+            Remove cache entry for if present.
+                Goes through the same queue as set_from_track_obj, so the two are applied in order.
+        """
+        if self.is_disabled():
+            return False
+        table = self._table(table)
+        if table is None:
+            return False
+
+        self._enqueue("delete", table, (os.fsencode(src),))
+        return True
+
+    def flush(self):
+        """Block until every queued write has been committed."""
+        if self._writer:
+            self._q.join()
+        return True
+
+    # ---------- bulk loading ----------
+    def begin_bulk_load(self):
+        """
+            Prepare for a sync pass that writes most of the cache.
+                Runs with synchronous=OFF, it's a cache: a crash costs a rescan, not data.
+        """
+        if self.is_disabled():
+            return False
+        # let the writer go idle, so nothing is mid-transaction while we switch modes
+        self.flush()
+        conn = self._connect()
+        if not conn:
+            return False
+        self._bulk_loading = True
+        with self._lock:
+            conns = list(self._conns)
+        # synchronous is per connection
+        for c in conns:
+            c.execute("PRAGMA synchronous=OFF;")
+        logger.debug("Cache: bulk load started")
+        return True
+
+    def end_bulk_load(self):
+        """ Commit everything queued during the bulk load and restore synchronous. """
+        if self.is_disabled() or not self._bulk_loading:
+            return False
+        self.flush()
+        conn = self._connect()
+        if not conn:
+            return False
+        self._bulk_loading = False
+        with self._lock:
+            conns = list(self._conns)
+        for c in conns:
+            c.execute("PRAGMA synchronous=NORMAL;")
+        logger.debug("Cache: bulk load finished")
+        return True
+
+    # ---------- writer thread ----------
+    def _enqueue(self, op: str, table: Table, params: tuple):
+        if not self._writer:
+            with self._lock:
+                if not self._writer:
+                    self._writer = threading.Thread(target=self._writer_loop, name="HashCacheWriter", daemon=True)
+                    self._writer.start()
+        with self._inflight_lock:
+            self._inflight[(table, params[0])] += 1
+        # blocks when the writer falls behind
+        self._q.put((op, table, params))
+
+    def _writer_loop(self):
+        done = False
+        while not done:
+            # wait for the first item, then give the batch a moment to fill up
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.WRITER_LINGER
+            while len(batch) < self.BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # None is the shutdown sentinel
+            done = any(item is None for item in batch)
+            ops = [item for item in batch if item is not None]
+            try:
+                if ops:
+                    self._write_batch(ops)
+                    logger.debug("WRITER: Committed %d queued writes", len(ops))
+            except Exception as e:
+                logger.error("WRITER: Error committing %d queued writes: %s", len(ops), e)
+            finally:
+                with self._inflight_lock:
+                    for _, table, params in ops:
+                        key = (table, params[0])
+                        self._inflight[key] -= 1
+                        if self._inflight[key] <= 0:
+                            del self._inflight[key]
+                for _ in batch:
+                    self._q.task_done()
+
+    def _write_batch(self, ops: List[tuple]):
+        """ Apply (op, table, params) writes in order inside one transaction, consecutive runs go through executemany. """
+        cur = self._cursor()
+        with self._write_lock:
+            cur.execute("BEGIN IMMEDIATE;")
+            try:
+                for (op, table), group in itertools.groupby(ops, key=lambda o: (o[0], o[1])):
+                    side = self.SIDES[table]
+                    cur.executemany(self._stmts[op], ((side, *params) for _, _, params in group))
+                cur.execute("COMMIT;")
+            except Exception:
+                cur.execute("ROLLBACK;")
+                raise
+
     def close(self):
-        try:
-            if self._conn:
-                self._conn.close()
-                self._conn = None
-        except Exception as e:
-            logger.error(f"Cannot seem to close DB connection: {e}")
-            pass
+        # drain the queue and stop the writer
+        if self._writer:
+            self.flush()
+            self._q.put(None)
+            self._writer.join()
+            self._writer = None
+        with self._lock:
+            conns, self._conns = self._conns, []
+            self._tls = threading.local()
+        # one bounded checkpoint at shutdown, also truncates the WAL file
+        if conns:
+            try:
+                conns[0].execute("PRAGMA wal_checkpoint(TRUNCATE);")
+            except Exception as e:
+                logger.error("Failed to checkpoint DB: %s", e)
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.error("Cannot seem to close DB connection: %s", e)
+                pass
 
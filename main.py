@@ -50,6 +50,12 @@ def build_arg_parser() -> argparse.ArgumentParser:
     parser.add_argument("--skip-input-caching",
                         action="store_true",
                         help="Disable input-side metadata/hash caching.")
+    parser.add_argument("--scan-workers", type=int,
+                        default=0,
+                        help="Threads reading uncached FLAC metadata during discovery (0=auto).")
+    parser.add_argument("--copy-workers", type=int,
+                        default=0,
+                        help="Concurrent file copies in the copy stage (0=auto).")
     parser.add_argument("--keep-empty-directories",
                         action="store_true",
                         help="Skip removing empty directories.")
@@ -65,31 +71,31 @@ def main():
     if args.save_config:
         save_config_file(args.config, config)
 
-    input_dir = Path(config.get("input"))
-    output_dir = Path(config.get("output"))
-    dry_run = bool(config.get("dry_run"))
-    verbosity = int(config.get("verbosity"))
-    log_file = Path(config.get("log_file"))
-    disable_cache = bool(config.get("disable_cache"))
+    # typed once here, everything downstream reads attributes
+    cfg = SyncConfig.from_dict(config)
 
-    setup_logging(verbosity, log_file)
+    setup_logging(cfg.verbosity, cfg.log_file)
 
     start = time.time()
     logger.info(f"Starting copy-sync at {datetime.now().isoformat()}")
-    logger.info(f"Input: {input_dir}  Output: {output_dir} Dry-run: {dry_run}")
+    logger.info(f"Input: {cfg.input_dir}  Output: {cfg.output_dir} Dry-run: {cfg.dry_run}")
 
     # Initialize cache (stored inside output_dir)
-    hash_cache = HashCache(output_dir, disabled=disable_cache, cache_filename=CACHE_FILENAME)
+    hash_cache = HashCache(cfg.output_dir, disabled=cfg.disable_cache, cache_filename=CACHE_FILENAME)
 
     try:
-        # Normal run
-        stats = perform_sync(
-            input_dir=input_dir,
-            output_dir=output_dir,
-            dry_run=dry_run,
-            hash_cache=hash_cache,
-            config=config
-        )
+        # Normal run, the signature index is rebuilt once afterwards instead of maintained per row
+        hash_cache.begin_bulk_load()
+        try:
+            stats = perform_sync(
+                input_dir=cfg.input_dir,
+                output_dir=cfg.output_dir,
+                dry_run=cfg.dry_run,
+                hash_cache=hash_cache,
+                config=cfg
+            )
+        finally:
+            hash_cache.end_bulk_load()
 
         elapsed = time.time() - start
 
@@ -1,13 +1,16 @@
 # ---------- main sync logic ----------
+import dataclasses
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict
 
 from HashCache import HashCache
 from scanner import discover_tracks
 from scanner import scan_directory_for_flacs
 from track import Track
-from utils import file_move, transactional_copy
+from utils import SyncConfig, file_move, transactional_copy
 
 # external libs
 try:
@@ -20,54 +23,50 @@ except ModuleNotFoundError:
 # ---------- logging ----------
 logger = logging.getLogger(__name__)
 
+# ---------- configuration ----------
+# concurrent copies in stage 2, enough to keep the storage queue busy
+COPY_WORKERS = min(8, os.cpu_count() or 1)
+# concurrent unlinks in stage 3, each one mostly waits on the filesystem journal
+DELETE_WORKERS = 16
 
-def determine_move_tasks(input_map: Dict[str, List[Track]], output_map: Dict[str, List[Track]],
+
+def determine_move_tasks(input_unique: Dict[str, Track], output_unique: Dict[str, Track],
                          output_dir: Path, hash_length: int):
     # so to determine if a file is an input is movable,
     # the same md5 hash must exist in both the input and output...
     # and also share the same meta_hashes
+    # only signatures held by a single track on their side are passed in, duplicates are never moved
+    # (discover_tracks has already reported them)
 
-    move_tasks = []
     # determine intersection
-    in_sigs = set(input_map.keys())
-    out_sigs = set(output_map.keys())
-    movables = in_sigs.intersection(out_sigs)
-
-    # determine the current states
-    for sig in movables:
-        sig_movable = True
-        new_intr = input_map[sig]
-        current_outtr = output_map[sig]
-
-        # ensure that only one track exists per sig
-        if len(new_intr) > 1:
-            logger.info(f"Detected one or more duplicates for input signatures, {sig} : see {new_intr}")
-            sig_movable = False
-        if len(current_outtr) > 1:
-            logger.info(f"Detected one or more duplicates for output signatures, {sig} : see {current_outtr}")
-            sig_movable = False
-
-        # unpack them
-        new_intr = new_intr[0]
-        current_outtr = current_outtr[0]
-
-        current_file_path = current_outtr.abs_path
-        new_file_path = new_intr.expected_output_path(output_dir, hash_length)
-
-        check_file_path = current_file_path != new_file_path
-        check_metadata = new_intr.metadata_hash == current_outtr.metadata_hash
-        if check_file_path and check_metadata and sig_movable:
-            # track must be movable
-            move_tasks.append((current_outtr, current_file_path, new_file_path))
+    movables = input_unique.keys() & output_unique.keys()
+
+    # track must be movable: same metadata, but not where the input says it should be
+    move_tasks = [
+        (output_unique[sig], output_unique[sig].abs_path, new_file_path)
+        for sig in movables
+        if input_unique[sig].metadata_hash == output_unique[sig].metadata_hash
+        and (new_file_path := input_unique[sig].expected_output_path(output_dir, hash_length)) != output_unique[sig].abs_path
+    ]
     logger.info(f"Identified {len(move_tasks)} movable candidates...")
     return move_tasks
 
+def _safe_unlink(p: Path):
+    """ Delete p, returning (deleted, p), errors are logged rather than raised. """
+    try:
+        p.unlink()
+        logger.info(f"DELETED: {p}")
+        return True, p
+    except Exception as e:
+        logger.error(f"Failed to delete {p}: {e}")
+        return False, p
+
 def perform_sync(
         input_dir: Path,
         output_dir: Path,
         dry_run: bool,
         hash_cache: HashCache,
-        config: Dict[str, Any]
+        config: SyncConfig
 ) -> Dict[str, int]:
     """
     expected_by_dst: dst_path -> (src_path, Track)
@@ -92,10 +91,14 @@ def perform_sync(
 
     # must scan input and output directories...
 
-    keep_empty_directories = bool(config.get("keep_empty_directories"))
+    keep_empty_directories = config.keep_empty_directories
+    hash_length = config.hash_length
+    scan_workers = config.scan_workers
 
-    discovered_input_files, input_tracks, input_audio_to_sigs = discover_tracks(input_dir, hash_cache, "in_cache", keep_empty_directories)
-    discovered_output_files, output_tracks, output_audio_to_sigs = discover_tracks(output_dir, hash_cache, "out_cache", keep_empty_directories)
+    discovered_input_files, input_tracks, input_audio_to_sigs, input_unique_sigs = discover_tracks(input_dir, hash_cache, "in_cache", keep_empty_directories, scan_workers)
+    discovered_output_files, output_tracks, output_audio_to_sigs, output_unique_sigs = discover_tracks(output_dir, hash_cache, "out_cache", keep_empty_directories, scan_workers)
+    # the walk already enumerated the output, answer "does dst exist" from it instead of a stat per track
+    existing_output_paths = set(discovered_output_files)
 
 
     logger.info("| ----- -------------- ----- |")
@@ -107,7 +110,7 @@ def perform_sync(
     # this step is only useful if there happens to be no meaningful metadata changes,
     # but somehow items are in the wrong place
 
-    movable_tasks = determine_move_tasks(input_audio_to_sigs, output_audio_to_sigs, output_dir, config["hash_length"])
+    movable_tasks = determine_move_tasks(input_unique_sigs, output_unique_sigs, output_dir, hash_length)
 
     logger.info("| ----- ---------------- ----- |")
     logger.info("| ----- stage 1.5: moves ----- |")
@@ -116,32 +119,49 @@ def perform_sync(
 
     stats["movables"] = len(movable_tasks)
 
+    # stale cache entries are dropped in one batch after each stage
+    moved_from = []
+    # position of each output track, by identity, instead of a list.index() scan per move
+    output_track_index = {id(tr): i for i, tr in enumerate(output_tracks)}
     movable_tasks = tqdm(movable_tasks, desc="Moving files...", unit="file") if TQDM_AVAILABLE else movable_tasks
     for current_outtr, current_file_path, new_file_path in movable_tasks:
-        # move the file
-        file_move(current_file_path, new_file_path)
-        # retrieve new track information from the file
-        new_outtr = Track.from_file(new_file_path, hash_cache, "out_cache")
-        hash_cache.remove(current_file_path, "out_cache")
+        # move the file, a failed move keeps the old track, so stage 2 copies it again
+        if not file_move(current_file_path, new_file_path, dry_run=dry_run):
+            stats["errors"] += 1
+            continue
+        # a move keeps the file's contents, mtime and size, so the track only changes path, no need to re-read its tags
+        new_outtr = dataclasses.replace(current_outtr, abs_path=new_file_path)
+        if not dry_run:
+            hash_cache.set_from_track_obj(new_file_path, "out_cache", new_outtr)
+        moved_from.append(current_file_path)
+        existing_output_paths.discard(current_file_path)
+        existing_output_paths.add(new_file_path)
         # replace output_track
-        indx = output_tracks.index(current_outtr)
+        indx = output_track_index.pop(id(current_outtr))
         output_tracks[indx] = new_outtr
+        output_track_index[id(new_outtr)] = indx
         # replace sig
-        output_audio_to_sigs[new_outtr.md5_audsig] = new_outtr
+        output_audio_to_sigs[new_outtr.md5_audsig] = [new_outtr]
+    # a path can be both vacated and refilled by another move
+    if not dry_run:
+        hash_cache.remove_many("out_cache", [p for p in moved_from if p not in existing_output_paths])
 
     logger.info("| ----- --------------- ----- |")
     logger.info("| ----- stage 2: copies ----- |")
     logger.info("| ----- --------------- ----- |")
 
     copy_tasks = []
+    # every path stage 3 should find in the output, collected while planning the copies
+    predicted_abs_p = set()
 
     it_input_tracks = tqdm(input_tracks, desc="Determining required copies...", unit="file") if TQDM_AVAILABLE else input_tracks
     for src_tr in it_input_tracks:
         in_abs_path = src_tr.abs_path
-        predicted_abs_path = src_tr.expected_output_path(output_dir, config["hash_length"])
+        predicted_abs_path = src_tr.expected_output_path(output_dir, hash_length)
+        predicted_abs_p.add(predicted_abs_path)
 
         # check if it exists
-        if predicted_abs_path.exists():
+        if predicted_abs_path in existing_output_paths:
             # we likely scanned it on the entry
             src_tr_audsig = src_tr.md5_audsig
             # let's see if we can find it via audio_sig
@@ -154,7 +174,7 @@ def perform_sync(
                         stats["skipped"] += 1
                         break
                 if out_tr and out_tr.metadata_hash == src_tr.metadata_hash:
-                    logger.debug(f"[cmp] up-to-date {out_tr.abs_path} - {out_tr.metadata_hash} : {src_tr.abs_path} - {src_tr.metadata_hash} ")
+                    logger.debug("[cmp] up-to-date %s - %s : %s - %s ", out_tr.abs_path, out_tr.metadata_hash, src_tr.abs_path, src_tr.metadata_hash)
                     # do nothing and continue on,
                     continue
                 # must have failed to find match... overwriting
@@ -167,15 +187,38 @@ def perform_sync(
 
     logger.info(f"Identified {len(copy_tasks)} required copies...")
 
-    it_copy_tasks = tqdm(copy_tasks, desc="Copying...", unit="file") if TQDM_AVAILABLE else copy_tasks
-    for task in it_copy_tasks:
-        src, dst, tr, boolean_to = task
-        try:
-            transactional_copy(src, dst, dry_run=dry_run)
-            stats["copied"] += 1
-            hash_cache.set_from_track_obj(dst, "out_cache", tr)
-        except Exception as e:
-            logger.error(f"{e}")
+    # create each destination directory once here, instead of every copy in an album racing to mkdir it
+    # a dry run creates nothing
+    if not dry_run:
+        failed_dirs = set()
+        for d in {dst.parent for _, dst, _, _ in copy_tasks}:
+            try:
+                d.mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                logger.error(f"Unable to create directory {d}: {e}")
+                failed_dirs.add(d)
+        if failed_dirs:
+            # copies into a missing directory can only fail, count them as errors without trying
+            stats["errors"] += sum(1 for _, dst, _, _ in copy_tasks if dst.parent in failed_dirs)
+            copy_tasks = [task for task in copy_tasks if task[1].parent not in failed_dirs]
+
+    # copies run on the pool, stats and cache updates stay on this thread as each one completes
+    # a dry run copies nothing, so there is nothing to overlap
+    copy_workers = 1 if dry_run else (config.copy_workers or COPY_WORKERS)
+    with ThreadPoolExecutor(max_workers=copy_workers) as executor:
+        futures = {executor.submit(transactional_copy, src, dst, dry_run=dry_run, make_parents=False): (src, dst, tr)
+                   for src, dst, tr, boolean_to in copy_tasks}
+        it_futures = tqdm(as_completed(futures), total=len(futures), desc="Copying...", unit="file") if TQDM_AVAILABLE else as_completed(futures)
+        for future in it_futures:
+            src, dst, tr = futures[future]
+            try:
+                future.result()
+                stats["copied"] += 1
+                hash_cache.set_from_track_obj(dst, "out_cache", tr)
+            except Exception as e:
+                logger.error(f"{e}")
+    # persist the batched cache writes from scanning, moving and copying
+    hash_cache.flush()
 
     # Delete any existing file that is not an expected dst
     logger.info("| ----- ----------------- ----- |")
@@ -183,27 +226,31 @@ def perform_sync(
     logger.info("| ----- ----------------- ----- |")
 
     output_existing_abs_paths = scan_directory_for_flacs(output_dir, keep_empty_directories)
-    predicted_abs_p = set([_.expected_output_path(output_dir, config["hash_length"]) for _ in input_tracks])
 
     logger.info(f"Updated output dir: {len(output_existing_abs_paths)} files found...")
     logger.info(f"Expecting: {len(predicted_abs_p)} files...")
     #to_delete = [Path(_) for _ in existing_abs_p if _ not in predicted_abs_p]
-    to_delete = [Path(_) for _ in output_existing_abs_paths.difference(predicted_abs_p)]
-    missing = [Path(_) for _ in predicted_abs_p.difference(output_existing_abs_paths)]
-    for p in to_delete:
-        if dry_run:
+    # both sides are resolved absolute Paths already, compare them directly
+    to_delete = output_existing_abs_paths - predicted_abs_p
+    if dry_run:
+        # a dry run left the moved files where they were, a real run would not find them there
+        to_delete.difference_update(moved_from)
+    missing = predicted_abs_p - output_existing_abs_paths
+    deleted = []
+    if dry_run:
+        for p in to_delete:
             logger.info(f"[dry-run] would delete {p}")
-        else:
-            try:
-                p.unlink()
-                logger.info(f"DELETED: {p}")
-                hash_cache.remove(p, "out_cache")
-            except Exception as e:
-                logger.error(f"Failed to delete {p}: {e}")
-                stats["errors"] += 1
-                continue
-        stats["deleted"] += 1
-
+            stats["deleted"] += 1
+    elif to_delete:
+        # unlinks run on the pool, cache entries are dropped here in one batch afterwards
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+            for ok, p in executor.map(_safe_unlink, to_delete):
+                if ok:
+                    deleted.append(p)
+                    stats["deleted"] += 1
+                else:
+                    stats["errors"] += 1
+    hash_cache.remove_many("out_cache", deleted)
 
     stats["total_inputs_found"] = len(predicted_abs_p)
     stats["total_outputs_found"] = len(output_existing_abs_paths)
@@ -1,10 +1,12 @@
 import logging
 import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Iterator, Optional
 
 from HashCache import HashCache
-from track import Track
+from track import Track, parse_flac
 
 # external libs
 try:
@@ -16,66 +18,185 @@ except ModuleNotFoundError:
 # -------- logging utils --------
 logger = logging.getLogger(__name__)
 
+# ---------- configuration ----------
+# FLAC reads are mostly I/O wait, so use more threads than cores
+READ_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# mutagen's parse is pure Python and holds the GIL, past this many misses a process pool pays for its startup
+PROCESS_POOL_MIN_FILES = 256
+PARSE_CHUNK_SIZE = 32
+# walked files looked up in the cache together, their misses start reading while the walk continues
+WALK_BATCH_SIZE = 512
+
 # ---------- scanning helpers ----------
 
-def scan_directory_for_flacs(directory: Path, remove_empty_dir: bool = True) -> set[Path]:
+def _walk_flac_entries(directory: Path, remove_empty_dir: bool) -> Iterator[os.DirEntry]:
     """
-    Returns a set of Path objects pointing to any discovered files ending in FLAC.
+    Walks directory with os.scandir, yielding the DirEntry of any discovered file ending in FLAC.
+    Entries keep their stat() result, so callers do not need to stat the file again.
       - remove_empty_dir - will remove any empty directories during its walk.
     """
-    logger.info(f"Running discovery for FLACs in {directory}")
-    flac_paths = set()
+    pending = [str(directory)]
+    while pending:
+        root = pending.pop()
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.error(f"Unable to scan directory {root}: {e}")
+            continue
+
+        if remove_empty_dir and not entries:
+            os.rmdir(root)
+            continue
+        for entry in entries:
+            # like os.walk, do not descend into symlinked directories
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    pending.append(entry.path)
+            elif entry.name.lower().endswith(".flac"):
+                yield entry
+
+def _entry_abs_path(entry: os.DirEntry) -> Path:
+    # the walk starts from a resolved directory, so only symlinked files need resolving
+    return Path(entry.path).resolve() if entry.is_symlink() else Path(entry.path)
 
+def _prepare_scan_root(directory: Path) -> Path:
+    logger.info(f"Running discovery for FLACs in {directory}")
     if not directory.exists():
         logger.info(f"Directory {directory} does not exist, creating empty folder.")
         directory.mkdir(exist_ok=True)
+    return directory.resolve()
 
-    for root, dirs, files in os.walk(directory):
-        p = Path(root)
-        if remove_empty_dir and not any(p.iterdir()):
-            p.rmdir()
-        for f in files:
-            if f.lower().endswith(".flac"):
-                fpath = Path(root) / f
-                flac_paths.add(fpath.resolve())
+def scan_directory_for_flacs(directory: Path, remove_empty_dir: bool = True) -> set[Path]:
+    """
+    Returns a set of Path objects pointing to any discovered files ending in FLAC.
+      - remove_empty_dir - will remove any empty directories during its walk.
+    """
+    root = _prepare_scan_root(directory)
+    flac_paths = {_entry_abs_path(entry) for entry in _walk_flac_entries(root, remove_empty_dir)}
 
     logger.info(f"Discovered {len(flac_paths)} FLACs in {directory}")
     return flac_paths
 
-def discover_tracks(directory: Path, hash_cache: HashCache, table: str, keep_empty_directories: bool):
-    discovered_file_paths = scan_directory_for_flacs(directory, keep_empty_directories)
+def iter_flac_stats(directory: Path, remove_empty_dir: bool = True) -> Iterator[Tuple[Path, os.stat_result]]:
+    """
+    Yields (Path, stat result) for any discovered file ending in FLAC, as soon as the walk reaches it.
+      - remove_empty_dir - will remove any empty directories during its walk.
+    """
+    root = _prepare_scan_root(directory)
+    for entry in _walk_flac_entries(root, remove_empty_dir):
+        try:
+            st = entry.stat()
+        except OSError as e:
+            logger.error(f"Unable to stat {entry.path}: {e}")
+            continue
+        yield _entry_abs_path(entry), st
+
+def _parse_flac_batch(paths: List[Path]) -> List[Optional[Dict[str, Optional[str]]]]:
+    """ parse_flac over several paths as a single pool task. """
+    return [parse_flac(p) for p in paths]
+
+def discover_tracks(directory: Path, hash_cache: HashCache, table: str, keep_empty_directories: bool,
+                    n_workers: int = 0):
+    """
+    Returns the walk's stats, the discovered Tracks, md5_audsig => list[Track],
+    and md5_audsig => Track for the signatures held by exactly one track.
+      - n_workers - workers reading uncached files, 0 uses READ_WORKERS.
+    The cache is checked every WALK_BATCH_SIZE walked files, so uncached files are read while the walk carries on.
+    """
+    n_workers = n_workers or READ_WORKERS
+    discovered_file_stats = {}
     # just in case that the MD5s cause collisions, we should append them to lists
     discovered_tracks = []
-    sigs_to_tracks = {}
-    possible_duplicate_sigs = set()
     # md5_audsig => list[track]
+    sigs_to_tracks = defaultdict(list)
+    # (future, paths, indexes into discovered_tracks) for every submitted read
+    pending_reads = []
+    thread_pool = process_pool = None
+    miss_count = 0
     logger.info("Retrieving metadata...")
 
-    # wrapping it in tqdm
-    discovered_file_paths = tqdm(discovered_file_paths,
-                                 desc="Scanning/retrieving metadata...",
-                                 unit="file") if TQDM_AVAILABLE else discovered_file_paths
-
-    for file_path in discovered_file_paths:
-        logger.debug(f"Attempting to retrieve {file_path}")
-        # retrieve track
-        tr = Track.from_cache(file_path, hash_cache, table)
-        discovered_tracks.append(tr)
-        # append
-        audsig = tr.md5_audsig
-        if audsig not in sigs_to_tracks:
-            sigs_to_tracks[audsig] = [tr]
+    def submit_misses(miss_paths: List[Path], miss_indexes: List[int]):
+        nonlocal thread_pool, process_pool, miss_count
+        miss_count += len(miss_paths)
+        if miss_count >= PROCESS_POOL_MIN_FILES:
+            if process_pool is None:
+                process_pool = ProcessPoolExecutor(max_workers=max(1, min(n_workers, os.cpu_count() or 1)))
+            executor, chunk_size = process_pool, PARSE_CHUNK_SIZE
         else:
-            sigs_to_tracks[audsig].append(tr)
-            possible_duplicate_sigs.add(audsig)
-            logger.info(f"WARN: Identified duplicate audio file with the same audio_signature. {audsig}")
+            if thread_pool is None:
+                thread_pool = ThreadPoolExecutor(max_workers=n_workers)
+            executor, chunk_size = thread_pool, 1
+        for i in range(0, len(miss_paths), chunk_size):
+            paths = miss_paths[i:i + chunk_size]
+            pending_reads.append((executor.submit(_parse_flac_batch, paths), paths, miss_indexes[i:i + chunk_size]))
+
+    def lookup_batch(batch: Dict[Path, os.stat_result]):
+        # one batched lookup per walk batch instead of a SELECT per file
+        present = set()
+        cached = hash_cache.get_many(table, batch, present)
+        # cache hits are cheap, the misses are handed to a pool straight away
+        miss_indexes = []
+        miss_paths = []
+        for file_path, st in batch.items():
+            logger.debug("Attempting to retrieve %s", file_path)
+            # retrieve track, reusing the stat from the walk
+            tr = Track.from_cache(file_path, hash_cache, table, st, read_on_miss=False,
+                                  prefetched=cached.get(file_path, {}),
+                                  # a path with a stale row was edited in place, not renamed
+                                  probe_inode=file_path not in present)
+            if tr is None:
+                miss_indexes.append(len(discovered_tracks))
+                miss_paths.append(file_path)
+            discovered_tracks.append(tr)
+        if miss_paths:
+            submit_misses(miss_paths, miss_indexes)
+
+    try:
+        walk = iter_flac_stats(directory, keep_empty_directories)
+        # wrapping it in tqdm
+        walk = tqdm(walk, desc="Scanning/retrieving metadata...", unit="file") if TQDM_AVAILABLE else walk
+        batch = {}
+        for file_path, st in walk:
+            discovered_file_stats[file_path] = st
+            batch[file_path] = st
+            if len(batch) >= WALK_BATCH_SIZE:
+                lookup_batch(batch)
+                batch = {}
+        if batch:
+            lookup_batch(batch)
+        logger.info(f"Discovered {len(discovered_file_stats)} FLACs in {directory}")
+
+        if pending_reads:
+            logger.info(f"Reading metadata for {miss_count} uncached FLACs...")
+            progress = tqdm(total=miss_count, desc="Reading uncached metadata...", unit="file") if TQDM_AVAILABLE else None
+            # Tracks are built and cached back on this thread
+            for future, paths, indexes in pending_reads:
+                for i, p, meta in zip(indexes, paths, future.result()):
+                    discovered_tracks[i] = Track.from_parsed(p, meta, hash_cache, table)
+                if progress is not None:
+                    progress.update(len(paths))
+            if progress is not None:
+                progress.close()
+    finally:
+        for executor in (thread_pool, process_pool):
+            if executor is not None:
+                executor.shutdown()
+
+    for tr in discovered_tracks:
+        sigs_to_tracks[tr.md5_audsig].append(tr)
+    # duplicates are rare, find them in one pass afterwards instead of checking on every append
+    possible_duplicate_sigs = {sig for sig, trs in sigs_to_tracks.items() if len(trs) > 1}
 
     if len(possible_duplicate_sigs) > 0:
         logger.info("WARN: Identified duplicate audio files with the same audio signatures.")
         for sig in possible_duplicate_sigs:
             tracks = sigs_to_tracks[sig]
+            logger.info(f"WARN: Identified duplicate audio file with the same audio_signature. {sig}")
             logger.info("||||||||||||{sig}")
             for tr in tracks:
                 logger.info(tr.human_readable())
             logger.info("||||||||||||{sig}")
-    return discovered_file_paths, discovered_tracks, sigs_to_tracks
\ No newline at end of file
+    # duplicates are already known here, so the move planner never has to look at them
+    unique_sigs = {sig: trs[0] for sig, trs in sigs_to_tracks.items() if sig not in possible_duplicate_sigs}
+    return discovered_file_stats, discovered_tracks, sigs_to_tracks, unique_sigs
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import track
+from track import FLAC_STREAMINFO, FLAC_VORBIS_COMMENT, _read_flac_blocks, _read_flac_mutagen, parse_flac
+
+FLAC_PADDING = 1
+FLAC_PICTURE = 6
+
+
+# ---------- FLAC file builders ----------
+def _block(block_type: int, body: bytes, last: bool = False) -> bytes:
+    return bytes([block_type | (0x80 if last else 0)]) + len(body).to_bytes(3, "big") + body
+
+def _streaminfo(md5: bytes = bytes(range(16))) -> bytes:
+    # 44.1kHz, stereo, 16 bits per sample, one second of audio
+    packed = (44100 << 44) | (1 << 41) | (15 << 36) | 44100
+    return struct.pack(">HH", 4096, 4096) + bytes(6) + packed.to_bytes(8, "big") + md5
+
+def _vorbis_comment(comments, vendor: bytes = b"music-organizer tests") -> bytes:
+    body = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    for comment in comments:
+        comment = comment.encode("utf-8")
+        body += struct.pack("<I", len(comment)) + comment
+    return body
+
+def _picture() -> bytes:
+    mime, description, data = b"image/png", b"cover", b"\x89PNG" + bytes(60)
+    return (struct.pack(">I", 3) + struct.pack(">I", len(mime)) + mime + struct.pack(">I", len(description)) + description
+            + struct.pack(">IIIII", 1, 1, 24, 0, len(data)) + data)
+
+def _flac(comments, before_comment=()) -> bytes:
+    blocks = [_block(FLAC_STREAMINFO, _streaminfo())]
+    blocks += [_block(block_type, body) for block_type, body in before_comment]
+    blocks.append(_block(FLAC_VORBIS_COMMENT, _vorbis_comment(comments), last=True))
+    return b"fLaC" + b"".join(blocks)
+
+
+# ---------- tests ----------
+class ReadFlacBlocksTest(unittest.TestCase):
+    """ _read_flac_blocks has to agree with mutagen, which it replaces on the hot path. """
+
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name: str, data: bytes) -> Path:
+        path = self.tmp / name
+        path.write_bytes(data)
+        return path
+
+    def assertMatchesMutagen(self, path: Path):
+        parsed = _read_flac_blocks(path)
+        self.assertIsNotNone(parsed)
+        self.assertEqual(parsed, _read_flac_mutagen(path))
+        return parsed
+
+    def test_multi_valued_tags(self):
+        path = self._write("multi.flac", _flac(["ARTIST=First", "ARTIST=Second", "ALBUM=Album", "TITLE=Title"]))
+        tags, _ = self.assertMatchesMutagen(path)
+        self.assertEqual(tags["artist"], ["First", "Second"])
+
+    def test_mixed_case_keys(self):
+        path = self._write("case.flac", _flac(["Artist=a", "artist=b", "ALBUMARTIST=c", "tItLe=d", "TrackNumber=3"]))
+        tags, _ = self.assertMatchesMutagen(path)
+        self.assertEqual(tags["artist"], ["a", "b"])
+        self.assertEqual(tags["tracknumber"], ["3"])
+
+    def test_comment_without_separator(self):
+        path = self._write("nokey.flac", _flac(["TITLE=Title", "no separator here", "ALBUM=a=b"]))
+        tags, _ = self.assertMatchesMutagen(path)
+        self.assertEqual(tags["album"], ["a=b"])
+
+    def test_picture_and_padding_before_comment(self):
+        path = self._write("picture.flac", _flac(["ARTIST=Artist", "TITLE=Title"],
+                                                 before_comment=[(FLAC_PICTURE, _picture()), (FLAC_PADDING, bytes(1024))]))
+        self.assertMatchesMutagen(path)
+
+    def test_md5_signature(self):
+        path = self._write("md5.flac", _flac(["TITLE=Title"]))
+        _, md5_signature = self.assertMatchesMutagen(path)
+        self.assertEqual(md5_signature, int.from_bytes(bytes(range(16)), "big"))
+
+    def test_parse_flac_matches_mutagen(self):
+        path = self._write("parse.flac", _flac(["ARTISTS=A;B", "ALBUMARTIST=C", "ALBUM=Album", "TITLE=Title", "TRACKNUMBER=7"]))
+        with mock.patch.object(track, "_read_flac_blocks", return_value=None):
+            expected = parse_flac(path)
+        self.assertEqual(parse_flac(path), expected)
+        self.assertEqual(expected["artist"], "A")
+
+    def test_truncated_block_falls_back_to_mutagen(self):
+        data = _flac(["ARTIST=Artist", "ALBUM=Album", "TITLE=Title"])
+        path = self._write("truncated.flac", data[:-8])
+        with self.assertRaises((struct.error, ValueError)):
+            _read_flac_blocks(path)
+        fallback = ({"title": ["From mutagen"]}, 0)
+        with mock.patch.object(track, "_read_flac_mutagen", return_value=fallback) as read_mutagen:
+            result = parse_flac(path)
+        read_mutagen.assert_called_once_with(path)
+        self.assertEqual(result["title"], "From mutagen")
+
+    def test_id3_prefixed_file_falls_back_to_mutagen(self):
+        # an empty ID3v2.4 tag in front of the fLaC marker
+        id3 = b"ID3\x04\x00\x00" + bytes(4)
+        path = self._write("id3.flac", id3 + _flac(["ARTIST=Artist", "ALBUM=Album", "TITLE=Title"]))
+        self.assertIsNone(_read_flac_blocks(path))
+        with mock.patch.object(track, "_read_flac_mutagen", wraps=_read_flac_mutagen) as read_mutagen:
+            result = parse_flac(path)
+        read_mutagen.assert_called_once_with(path)
+        self.assertEqual((result["artist"], result["album"], result["title"]), ("Artist", "Album", "Title"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,15 @@
 # ---------- Track dataclass ----------
+import functools
 import logging
-from dataclasses import dataclass
+import os
+import struct
+import sys
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional, Dict, Union
 
 from HashCache import HashCache
-from utils import sanitize_for_path, HashingHelper
+from utils import sanitize_for_path, default_hasher
 
 # external libs
 try:
@@ -18,8 +22,131 @@ except Exception:
 logger = logging.getLogger(__name__)
 
 
+# ---------- FLAC parsing ----------
+FLAC_STREAMINFO = 0
+FLAC_VORBIS_COMMENT = 4
+# stands in for a missing tag, so a default never allocates a list
+_NO_TAG = (None,)
+
+def _read_flac_blocks(abs_path: Union[Path, str]):
+    """
+    Read only the STREAMINFO and VORBIS_COMMENT metadata blocks, seeking past everything else (pictures, padding...).
+    Returns (tags, md5_signature) with tags as lowercased key -> list of values, mirroring mutagen's FLAC,
+    or None if the file doesn't start with a bare 'fLaC' marker (e.g. a leading ID3 tag), so mutagen can handle it.
+    """
+    tags: Dict[str, list] = {}
+    md5_signature = 0
+    with open(abs_path, "rb") as f:
+        if f.read(4) != b"fLaC":
+            return None
+        seen_streaminfo = seen_comment = False
+        last = False
+        while not last and not (seen_streaminfo and seen_comment):
+            header = f.read(4)
+            if len(header) < 4:
+                break
+            last = bool(header[0] & 0x80)
+            block_type = header[0] & 0x7F
+            length = int.from_bytes(header[1:4], "big")
+            if block_type == FLAC_STREAMINFO:
+                body = f.read(length)
+                if len(body) < 34:
+                    raise ValueError("truncated STREAMINFO block")
+                # the MD5 of the unencoded audio is the last 16 bytes of the 34 byte block
+                md5_signature = int.from_bytes(body[18:34], "big")
+                seen_streaminfo = True
+            elif block_type == FLAC_VORBIS_COMMENT:
+                body = f.read(length)
+                # little-endian length prefixed: vendor string, comment count, then 'KEY=value' comments
+                vendor_length, = struct.unpack_from("<I", body, 0)
+                offset = 4 + vendor_length
+                count, = struct.unpack_from("<I", body, offset)
+                offset += 4
+                for i in range(count):
+                    comment_length, = struct.unpack_from("<I", body, offset)
+                    offset += 4
+                    comment = body[offset:offset + comment_length].decode("utf-8", errors="replace")
+                    offset += comment_length
+                    key, sep, value = comment.partition("=")
+                    if sep:
+                        tags.setdefault(key.lower(), []).append(value)
+                    else:
+                        # mutagen keeps a comment without a key under a made up one
+                        tags.setdefault(f"unknown{i}", []).append(comment)
+                # a comment running past the end of the block was sliced short above
+                if offset > len(body):
+                    raise ValueError("truncated VORBIS_COMMENT block")
+                seen_comment = True
+            else:
+                f.seek(length, os.SEEK_CUR)
+    return tags, md5_signature
+
+def _read_flac_mutagen(abs_path: Union[Path, str]):
+    """ Same result as _read_flac_blocks, through mutagen, which copes with everything else. """
+    audio = FLAC(abs_path)
+    tags: Dict[str, list] = {}
+    for key, value in (audio.tags or []):
+        tags.setdefault(key.lower(), []).append(value)
+    # type is seemingly guaranteed by StreamInfo
+    return tags, audio.info.md5_signature if audio.info.md5_signature else 0
+
+def parse_flac(abs_path: Union[Path, str]) -> Optional[Dict[str, Optional[str]]]:
+    """
+    Read the tags a Track is built from, as the dictionary Track._create_track expects; None if the file cannot be read.
+    Kept at module level and free of any cache state, so it can run in a process pool.
+    """
+    try:
+        try:
+            parsed = _read_flac_blocks(abs_path)
+        except (struct.error, ValueError) as e:
+            logger.debug("Falling back to mutagen for %s: %s", abs_path, e)
+            parsed = None
+        tags, int_md5_signature = parsed if parsed is not None else _read_flac_mutagen(abs_path)
+        # results are always wrapped in a list, so always unwrap the first result, keys are lowercase
+        # |: priority >>> first_in_artists_tag, album_artist, artist, _dflt
+        artists = tags.get("artists")
+        if artists:
+            artist = artists[0].partition(";")[0]
+        else:
+            artist = (tags.get("albumartist") or tags.get("artist") or _NO_TAG)[0]
+        logger.debug("Determined albumartist to be: %s for %s", artist, abs_path)
+        # |: priority >>> album, _dflt
+        album = (tags.get("album") or _NO_TAG)[0]
+        # |: priority >>> title, _dflt
+        title = (tags.get("title") or _NO_TAG)[0]
+        # |: priority >>> track_number, _dflt
+        track_number = (tags.get("tracknumber") or _NO_TAG)[0]
+        # |: priority >>> md5_signature, _dflt
+        audio_md5_signature = hex(int_md5_signature)
+
+        return {
+            "abs_path": str(abs_path),
+            "title": title,
+            "artist": artist,
+            "album": album,
+            "track_number": track_number,
+            "": "",
+            "": "",
+            "md5_audsig": audio_md5_signature,
+        }
+    except Exception as e:
+        logger.debug("Failed reading FLAC metadata for %s: %s", abs_path, e)
+        return None
+
+
+# ---------- Track helpers ----------
+# the tags metadata_hash covers, in hashing order
+DEFAULT_META_HASH_KEYS = ("title", "artist", "album")
+
+# resolved album directory, shared by every track of the album, bounded like sanitize_for_path
+@functools.lru_cache(maxsize=8192)
+def _album_dir(base_output: Path, artist: str, album: str) -> Path:
+    # a sanitized filename holds no separators or dots, so resolving the directory once is enough
+    return (base_output / sanitize_for_path(artist) / sanitize_for_path(album)).resolve()
+
+
 # ---------- Track ----------
-@dataclass
+@dataclass(slots=True)
 class Track:
     # defaults
     abs_path: Path
@@ -29,6 +156,9 @@ class Track:
     track_number: int
     metadata_hash: str # hash result of previous information
     md5_audsig: str # embedded md5 hash in flac
+    # memo for expected_output_path, (base_output, length) -> Path
+    _expected_key: Optional[tuple] = field(default=None, init=False, repr=False, compare=False)
+    _expected_path: Optional[Path] = field(default=None, init=False, repr=False, compare=False)
 
 
     @classmethod
@@ -40,19 +170,22 @@ class Track:
             logger.error("Provided track_info dictionary has no abs_path.")
             raise FileNotFoundError
 
-        # should get any available hashing helper
-        hasher = HashingHelper()
-        DEFAULT_META_HASH_KEYS = ["title", "artist", "album"]
-
         # : _dflts
         abs_path      = track_info.get("abs_path",      "")
-        title         = track_info.get("title",         "Unknown Track")
-        artist        = track_info.get("artist",        "Unknown Artist")
-        album         = track_info.get("album",         "Unknown Album")
-        metadata_hash = track_info.get("metadata_hash", hasher.hash_dict_vals(track_info, DEFAULT_META_HASH_KEYS))
+        # parse_flac reports a missing tag as None, which should get the default as well
+        title         = track_info.get("title")         or "Unknown Track"
+        # interned, so every track of an artist/album shares one string and equal ones short-circuit on identity
+        artist        = sys.intern(track_info.get("artist") or "Unknown Artist")
+        album         = sys.intern(track_info.get("album")  or "Unknown Album")
+        metadata_hash = track_info.get("metadata_hash")
         track_number  = track_info.get("track_number",  -1)
         md5_audsig    = track_info.get("md5_audsig",    "0x{unknown signature}")
 
+        # cache hits carry the stored hash, only hash the tags when it is missing
+        # (a .get() default would be computed for every track regardless)
+        if metadata_hash is None:
+            metadata_hash = default_hasher.hash_dict_vals(track_info, DEFAULT_META_HASH_KEYS)
+
         # attempt cast of track_number
         try:
             track_number = int(track_number)
@@ -71,19 +204,44 @@ class Track:
         )
 
     @classmethod
-    def from_cache(cls, file_path: Path, hash_cache: HashCache, table: str) -> Optional["Track"]:
+    def from_cache(cls, file_path: Path, hash_cache: HashCache, table: str,
+                   st: Optional[os.stat_result] = None, read_on_miss: bool = True,
+                   prefetched: Optional[dict] = None, probe_inode: bool = True) -> Optional["Track"]:
         """
         Use cache (if enabled) to avoid re-reading metadata from disk and re-hashing when
         mtime+size are unchanged.
+        If a stat result is provided, file_path is trusted to be absolute and is not stat'd again.
+        If read_on_miss is False, a cache miss returns None instead of reading the file.
+        If prefetched is provided (HashCache.get_many's entry for this file, {} for a miss), the path lookup is skipped.
+        If probe_inode is False, a miss is not looked up by inode, e.g. the path has a row that is merely stale.
 
         Will fall back to a clean read if anything goes wrong with the cache.
         """
-        result = hash_cache.get_track_metadata_if_unchanged_mtime_size(file_path, table)
+        if prefetched is not None:
+            result = prefetched
+        elif st is not None:
+            result = hash_cache.get_many(table, {file_path: st}).get(file_path)
+        else:
+            result = hash_cache.get_track_metadata_if_unchanged_mtime_size(file_path, table)
         if result:
-            logger.debug(f"Cache hit for track: {result['title']}")
+            logger.debug("Cache hit for track: %s", result['title'])
             return cls._create_track( result )
+        # renamed or moved since it was cached, the same inode still carries the same tags
+        if probe_inode and st is not None:
+            result = hash_cache.get_track_metadata_by_inode(file_path, table, st)
+        if result:
+            logger.debug("Cache hit by inode for track: %s", result['title'])
+            tr = cls._create_track( result )
+            # so the next lookup hits on the path
+            hash_cache.set_from_track_obj(file_path, table, tr)
+            return tr
         else:
-            logger.debug(f"Cache miss: {file_path}")
+            logger.debug("Cache miss: %s", file_path)
+            if not read_on_miss:
+                return None
+            # a walk stat means the path is already canonical, only from_file needs to resolve() it
+            if st is not None:
+                return cls.from_parsed(file_path, parse_flac(file_path), hash_cache, table)
             return cls.from_file( file_path, hash_cache, table )
 
     @classmethod
@@ -102,60 +260,44 @@ class Track:
             logger.error(f"Unable to resolve path, infinite loop: {e}")
             return None
 
-        try:
-            audio = FLAC(abs_path)
-            # results are always wrapped in a list, so always unwrap the first result
-            # |: priority >>> first_in_artists_tag, album_artist, artist, _dflt
-            if audio.get("ARTISTS"):
-                artist = audio.get("ARTISTS")[0]
-                if ";" in artist:
-                    artist = artist.split(";")[0]
-            else:
-                artist = audio.get("albumartist", audio.get("artist", [None]))[0]
-            logger.debug(f"Determined albumartist to be: {artist} for {abs_path}")
-            # |: priority >>> album, _dflt
-            album = audio.get("album", [None])[0]
-            # |: priority >>> title, _dflt
-            title = audio.get("title", [None])[0]
-            # |: priority >>> track_number, _dflt
-            track_number = audio.get("tracknumber", [None])[0]
-            # |: priority >>> md5_signature, _dflt
-            # type is seemingly guaranteed by StreamInfo
-            int_md5_signature = audio.info.md5_signature if audio.info.md5_signature else 0
-            audio_md5_signature = hex(int_md5_signature)
-
-            meta_dict = {
-                "abs_path": str(abs_path),
-                "title": title,
-                "artist": artist,
-                "album": album,
-                "track_number": track_number,
-                "": "",
-                "": "",
-                "md5_audsig": audio_md5_signature,
-            }
+        return cls.from_parsed(abs_path, parse_flac(abs_path), hash_cache, table)
 
+    @classmethod
+    def from_parsed(cls, abs_path: Path, meta_dict: Optional[Dict[str, Optional[str]]],
+                    hash_cache: HashCache, table: str) -> Optional["Track"]:
+        """
+        Create a Track from the result of parse_flac, which may have run in another process.
+        Will always write the results back to the cache if provided and enabled...
+        """
+        if meta_dict is None:
+            return None
+        try:
             tr = cls._create_track(meta_dict)
             # return early if cache is disabled
             if hash_cache.is_disabled():
                 return tr
             # otherwise, try to keep the database updated
             if not hash_cache.set_from_track_obj(abs_path, table, tr):
-                logger.debug(f"Cache: Failed to save track '{tr.title}'-'{tr.artist}' information to table {table}")
+                logger.debug("Cache: Failed to save track '%s'-'%s' information to table %s", tr.title, tr.artist, table)
             return tr
         except Exception as e:
-            logger.debug(f"Failed reading FLAC metadata for {abs_path}: {e}")
+            logger.debug("Failed creating track for %s: %s", abs_path, e)
             return None
 
     def md5_audsig_tag(self, length: int = 4) -> str:
         return self.md5_audsig[:length]
 
     def expected_output_path(self, base_output: Path, length: int = 4) -> Path:
-        safe_artist = sanitize_for_path(self.artist)
-        safe_album = sanitize_for_path(self.album)
-        filename = f"{sanitize_for_path(self.title)}-{self.md5_audsig_tag(length)}.flac"
-        expected_path = base_output / safe_artist / safe_album / filename
-        return expected_path.resolve()
+        # called several times per track during a sync, always with the same arguments
+        key = (base_output, length)
+        if self._expected_key != key:
+            self._expected_path = self._compute_expected_output_path(base_output, length)
+            self._expected_key = key
+        return self._expected_path
+
+    def _compute_expected_output_path(self, base_output: Path, length: int) -> Path:
+        filename = f"{sanitize_for_path(self.title)}-{self.md5_audsig[:length]}.flac"
+        return _album_dir(base_output, self.artist, self.album) / filename
 
     def human_readable(self):
         return f"_{self.title}-{self.album}.{self.artist}_"
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import argparse
+import errno
+import functools
 import hashlib
 import json
 import logging
@@ -9,13 +11,26 @@ import re
 import shutil
 import sys
 import tempfile
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional, Dict, List
 
+# external libs
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ModuleNotFoundError:
+    ORJSON_AVAILABLE = False
+
 # ---------- UTILITIES ----------
 
 # ---------- constants ----------
 INVALID_PATH_CHARS = r'\/:*?"<>|.'
+# deletes every INVALID_PATH_CHARS character in a single str.translate pass
+_SANITIZE_TABLE = str.maketrans("", "", INVALID_PATH_CHARS)
+_WS_RE = re.compile(r"\s{2,}")
+# bytes requested per os.copy_file_range call, the kernel may copy less
+COPY_CHUNK_SIZE = 1 << 30
 
 # -------- logging utils --------
 logger = logging.getLogger(__name__)
@@ -46,38 +61,121 @@ class PrefixLoggerAdapter(logging.LoggerAdapter):
         return f'[{self.extra["nickname"]}] ' + msg, kwargs
 
 # ---------- fs helpers ----------
-def transactional_copy(src: Path, dst: Path, dry_run: bool = False) -> None:
+def _copy_file_obj(fsrc, fdst) -> None:
+    """
+    Copy the contents of the open file fsrc into fdst.
+    - uses os.copy_file_range where available, the data never passes through user space
+      and filesystems that support it (XFS, Btrfs) can reflink instead of copying.
+    - falls back to a regular copy when the kernel or filesystem pair cannot do it (e.g. EXDEV).
+    """
+    # the source is read front to back once, let the kernel read ahead aggressively
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fsrc.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    if not hasattr(os, "copy_file_range"):
+        shutil.copyfileobj(fsrc, fdst)
+        return
+    try:
+        while os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK_SIZE):
+            pass
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+            raise
+        # start over, part of the file may already have been copied
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+
+def _copy_file_data(src: Path, dst: Path) -> None:
+    """ Copy the contents of src into dst, see _copy_file_obj. """
+    if not hasattr(os, "copy_file_range"):
+        shutil.copyfile(src, dst)
+        return
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        _copy_file_obj(fsrc, fdst)
+
+def _copy_via_tmpfile(src: Path, dst: Path) -> bool:
     """
-    GPT-generated: Transactional copy using shutil.copy2
-    - copy to a temp file in dst dir then os.replace.
+    Copy src into an unnamed O_TMPFILE inode in dst's directory, then link it in as dst.
+    - nothing appears at dst before it is complete, and an interrupted copy leaves no temp file behind.
+    - returns False, having created nothing, when the platform or filesystem can't do it or dst already exists
+      (linkat cannot replace a file), the caller should then take the named temp file route.
+    """
+    if not hasattr(os, "O_TMPFILE") or os.path.lexists(dst):
+        return False
+    try:
+        dir_fd = os.open(dst.parent, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return False
+    try:
+        try:
+            fd = os.open(".", os.O_TMPFILE | os.O_WRONLY, 0o600, dir_fd=dir_fd)
+        except OSError:
+            return False
+        with os.fdopen(fd, "wb") as fdst:
+            with open(src, "rb") as fsrc:
+                _copy_file_obj(fsrc, fdst)
+            fdst.flush()
+            # the inode can only be reached through /proc until it is linked
+            fd_path = f"/proc/self/fd/{fd}"
+            try:
+                shutil.copystat(src, fd_path)
+                # linkat(..., AT_SYMLINK_FOLLOW), os.link only calls linkat() when given a dir fd
+                os.link(fd_path, dst.name, dst_dir_fd=dir_fd, follow_symlinks=True)
+            except OSError as e:
+                # lost a race for dst, no /proc, or a /proc or filesystem that refuses the link (EPERM, EACCES...)
+                logger.debug("O_TMPFILE link failed for %s, falling back to a named temp file: %s", dst, e)
+                return False
+        return True
+    finally:
+        os.close(dir_fd)
+
+def transactional_copy(src: Path, dst: Path, dry_run: bool = False, make_parents: bool = True) -> None:
+    """
+    GPT-generated: Transactional copy, equivalent to shutil.copy2
+    - copy to an unnamed O_TMPFILE in dst dir then link it in, where Linux and the filesystem allow it.
+    - otherwise copy to a temp file in dst dir then os.replace.
     - attempts to guarantee no partial file ever appears at dst.
+    - make_parents=False skips creating dst's directory, for callers that already did.
     """
-    dst.parent.mkdir(parents=True, exist_ok=True)
+    if make_parents:
+        dst.parent.mkdir(parents=True, exist_ok=True)
 
     if dry_run:
-        logger.debug(f"[dry-run] would transactional copy2 {src} -> {dst}")
+        logger.debug("[dry-run] would transactional copy2 %s -> %s", src, dst)
         return
 
+    try:
+        if _copy_via_tmpfile(src, dst):
+            logger.debug("transactional copy2 complete: %s -> %s", src, dst)
+            return
+    except Exception as e:
+        # nothing was linked, the unnamed file is gone with its descriptor, try the named temp file instead
+        logger.warning(f"O_TMPFILE copy failed for {dst}, falling back to a named temp file: {e}")
+
     with tempfile.NamedTemporaryFile(delete=False, dir=dst.parent) as tf:
         tmp_path = Path(tf.name)
     try:
-        shutil.copy2(src, tmp_path)
+        _copy_file_data(src, tmp_path)
+        shutil.copystat(src, tmp_path)
         os.replace(tmp_path, dst)
-        logger.debug(f"transactional copy2 complete: {src} -> {dst}")
+        logger.debug("transactional copy2 complete: %s -> %s", src, dst)
     except Exception:
         # Cleanup leftover temp file on error
         tmp_path.unlink(missing_ok=True)
 
-
-def file_move(src: Path, dst: Path, dry_run: bool = False) -> None:
+def file_move(src: Path, dst: Path, dry_run: bool = False) -> bool:
+    """ Move src to dst, returning whether it was (or on a dry run, would be) moved, errors are logged rather than raised. """
     if dry_run:
-        logger.debug(f"[dry-run] would move {src} -> {dst}")
-    else:
-        try:
-            os.replace(src, dst)
-        except Exception:
-            pass
-    return
+        logger.debug("[dry-run] would move %s -> %s", src, dst)
+        return True
+    try:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src, dst)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to move {src} -> {dst}: {e}")
+        return False
 
 
 # ---------- hashing helpers ----------
@@ -140,33 +238,38 @@ class HashingHelper(object):
     def hash_str_list(self, input_buffer: List[str]) -> str:
         """ Return a hash of stringified items in normalized hexadecimal string format (without 0x)."""
         h = self._new_hasher_instance()
-        for s in input_buffer:
-            h.update(str(s).encode("utf-8"))
+        # a single update for the whole list, the unit separator keeps ["ab", "c"] and ["a", "bc"] apart
+        h.update(b"\x1f".join(str(s).encode("utf-8") for s in input_buffer))
         hash_str = self._normalize_to_str(h)
         if self.DEBUG:
             logger.debug(f"Computed {self.algorithm} hash for {input_buffer}: {hash_str}")
         return hash_str
 
     def hash_dict_vals(self, input_dict: Dict[str, str], keys: Optional[List[str]]) -> str:
-        """ Return the hash of a dictionary's sorted values in normalized hexadecimal string format (without 0x).
-            If any keys are provided, the order of the keys is preserved.
+        """ Return the hash of a dictionary's 'key=value' pairs, sorted by key, in normalized hexadecimal string format (without 0x).
+            If any keys are provided, only their values are hashed and the order of the keys is preserved.
         """
         if keys:
-            hash_vals = []
-            # theoretically, the for_loop should keep them order of the keys
-            for k in keys:
-                if k not in input_dict:
-                    logger.error(f"Provided key: {k} does not exist in input dictionary.")
-                hash_vals.append(input_dict.get(k, ""))
+            # the comprehension keeps the order of the keys
+            hash_vals = [input_dict[k] if k in input_dict else _missing_hash_key(k) for k in keys]
         else:
-            hash_vals = [str(_) for _ in input_dict.values()]
-            hash_vals.sort()
+            # keys are unique, so sorting the items never has to compare values
+            hash_vals = [f"{k}={v}" for k, v in sorted(input_dict.items())]
         return self.hash_str_list(hash_vals)
 
+def _missing_hash_key(k: str) -> str:
+    logger.error(f"Provided key: {k} does not exist in input dictionary.")
+    return ""
+
+# the shared helper, resolved once at import instead of going through HashingHelper() on every track
+default_hasher = HashingHelper()
+
+# artists and albums repeat across many tracks, so most calls are repeats
+@functools.lru_cache(maxsize=8192)
 def sanitize_for_path(s: str, max_len: int = 32) -> str:
     # GPT-generated
-    s = "".join(ch for ch in s if ch not in INVALID_PATH_CHARS)
-    s = re.sub(r"\s{2,}", " ", s).strip()
+    s = s.translate(_SANITIZE_TABLE)
+    s = _WS_RE.sub(" ", s).strip()
     # normalize text
     #s = unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode('ascii')
     if len(s) > max_len:
@@ -176,13 +279,22 @@ def sanitize_for_path(s: str, max_len: int = 32) -> str:
 
 
 # ---------- cli helpers ----------
+def _json_dumps(cfg: Dict) -> str:
+    """ Indented, non-ASCII kept as is; through orjson when it is installed. """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(cfg, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(cfg, indent=2, ensure_ascii=False)
+
+def _json_loads(raw: str):
+    return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+
 def save_config_file(path: str, cfg: Dict):
     """Save JSON config."""
     try:
         p = Path(path)
         p.parent.mkdir(parents=True, exist_ok=True)
         with p.open("w", encoding="utf-8") as f:
-            json.dump(cfg, f, indent=2, ensure_ascii=False)
+            f.write(_json_dumps(cfg))
         logger.info(f"Saved merged configuration to {path}")
     except Exception as e:
         logger.error(f"Failed to save config to {path}: {e}")
@@ -199,7 +311,7 @@ def load_config_file(path: Optional[str]) -> Dict:
             return {}
         with p.open("r", encoding="utf-8") as f:
             raw = f.read()
-            cfg = json.loads(raw)
+            cfg = _json_loads(raw)
             logger.info(f"Loaded config: {path}")
             return dict(cfg)
     except Exception as e:
@@ -213,13 +325,49 @@ def merge_config_with_args(config: Dict, args: argparse.Namespace, parser: argpa
     Behavior: CLI overrides config. If CLI used default for a flag, use config value if present,
     otherwise keep the parser default.
     """
-    merged = dict(config)
+    merged = {**config}
+    # parser.get_default() walks every action per call, collect the defaults in one pass instead
+    # (same precedence: an action's non-None default, then set_defaults())
+    defaults = {**parser._defaults,
+                **{action.dest: action.default for action in reversed(parser._actions) if action.default is not None}}
     for key, value in vars(args).items():
         if key in ("config", "save_config"):
             continue
-        default = parser.get_default(key)
+        default = defaults.get(key)
         if value != default:
             merged[key] = value
         else:
             merged[key] = config.get(key, default)
     return merged
+
+
+@dataclass(slots=True)
+class SyncConfig:
+    """ Resolved run configuration, built once from the merged config dict. """
+    input_dir: Path
+    output_dir: Path
+    hash_length: int
+    dry_run: bool
+    verbosity: int
+    log_file: Path
+    disable_cache: bool
+    skip_input_caching: bool
+    keep_empty_directories: bool
+    scan_workers: int
+    copy_workers: int
+
+    @classmethod
+    def from_dict(cls, merged: Dict) -> "SyncConfig":
+        return cls(
+            input_dir=Path(merged.get("input")),
+            output_dir=Path(merged.get("output")),
+            hash_length=int(merged.get("hash_length")),
+            dry_run=bool(merged.get("dry_run")),
+            verbosity=int(merged.get("verbosity")),
+            log_file=Path(merged.get("log_file")),
+            disable_cache=bool(merged.get("disable_cache")),
+            skip_input_caching=bool(merged.get("skip_input_caching")),
+            keep_empty_directories=bool(merged.get("keep_empty_directories")),
+            scan_workers=int(merged.get("scan_workers") or 0),
+            copy_workers=int(merged.get("copy_workers") or 0),
+        )